@@ -2,85 +2,28 @@
 from __future__ import annotations
 
 import argparse
+import atexit
+import functools
 import logging
-import os
+import logging.handlers
+import multiprocessing.util
 import re
+import sqlite3
 import sys
 import time
-from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Iterator
+
+from scanner import ANSI_CYAN, ANSI_RED, Matcher, ResultCache, ScanOptions, Stats, colorize, scan_path
 
 
 # ----------------------------
 # Color helpers
 # ----------------------------
-ANSI_RESET = "\x1b[0m"
-ANSI_DIM = "\x1b[2m"
-ANSI_RED = "\x1b[31m"
-ANSI_YELLOW = "\x1b[33m"
-ANSI_CYAN = "\x1b[36m"
-
-
 def supports_color(stream) -> bool:
     return hasattr(stream, "isatty") and stream.isatty()
 
 
-def colorize(s: str, color: str, enabled: bool) -> str:
-    return f"{color}{s}{ANSI_RESET}" if enabled else s
-
-
-def highlight_regex_first(line: str, rx: re.Pattern, enabled: bool) -> str:
-    if not enabled:
-        return line
-    m = rx.search(line)
-    if not m:
-        return line
-    a, b = m.span()
-    return line[:a] + ANSI_YELLOW + line[a:b] + ANSI_RESET + line[b:]
-
-
-# ----------------------------
-# Stats
-# ----------------------------
-@dataclass
-class Stats:
-    files_seen: int = 0
-    files_read: int = 0
-    files_skipped_binary: int = 0
-    lines_seen: int = 0
-    lines_reported: int = 0
-    elapsed_s: float = 0.0
-
-
-# ----------------------------
-# File iteration + heuristics
-# ----------------------------
-def is_probably_text_file(path: Path, sample_size: int = 4096) -> bool:
-    try:
-        with path.open("rb") as f:
-            chunk = f.read(sample_size)
-        return b"\x00" not in chunk
-    except OSError:
-        return False
-
-
-def iter_files(inputs: list[Path], recursive: bool) -> Iterator[Path]:
-    for p in inputs:
-        if p.is_file():
-            yield p
-        elif p.is_dir():
-            if recursive:
-                for fp in p.rglob("*"):
-                    if fp.is_file():
-                        yield fp
-            else:
-                for fp in p.glob("*"):
-                    if fp.is_file():
-                        yield fp
-
-
 # ----------------------------
 # Logging (ALWAYS ON)
 # ----------------------------
@@ -96,20 +39,23 @@ def make_log_path() -> Path:
     return logs_dir / f"log_{ts}.txt"
 
 
-def setup_logging(debug: bool) -> tuple[logging.Logger, Path]:
+def configure_logger(log_path: Path, debug: bool) -> logging.Logger:
     logger = logging.getLogger("grep")
     logger.setLevel(logging.DEBUG if debug else logging.INFO)
     logger.handlers.clear()
 
-    log_path = make_log_path()
-
     fmt = logging.Formatter("%(asctime)s %(levelname)s: %(message)s")
 
     # File handler ALWAYS enabled (all runs log to file)
     fh = logging.FileHandler(log_path, encoding="utf-8")
     fh.setLevel(logging.DEBUG if debug else logging.INFO)
     fh.setFormatter(fmt)
-    logger.addHandler(fh)
+
+    # Batch file writes (--debug logs once per file); errors are written right away
+    mh = logging.handlers.MemoryHandler(1024, flushLevel=logging.ERROR, target=fh)
+    mh.setLevel(logging.DEBUG if debug else logging.INFO)
+    logger.addHandler(mh)
+    atexit.register(mh.close)  # close() flushes what is still buffered
 
     # Console handler for user-facing errors (keep terminal clean)
     ch = logging.StreamHandler(sys.stderr)
@@ -117,69 +63,36 @@ def setup_logging(debug: bool) -> tuple[logging.Logger, Path]:
     ch.setFormatter(fmt)
     logger.addHandler(ch)
 
-    logger.info("Log started: %s", log_path)
-    logger.info("CWD: %s", Path.cwd())
+    return logger
 
-    return logger, log_path
 
+def configure_worker_logger(log_path: Path, debug: bool) -> None:
+    logger = configure_logger(log_path, debug)
+    # Pool workers exit without running atexit, so flush the log buffer from a finalizer
+    for h in logger.handlers:
+        multiprocessing.util.Finalize(None, h.close, exitpriority=0)
 
-# ----------------------------
-# Grep core
-# ----------------------------
-def grep_file(
-    filepath: Path,
-    rx: re.Pattern,
-    invert: bool,
-    count_only: bool,
-    color_enabled: bool,
-    logger: logging.Logger,
-    stats: Stats,
-) -> None:
-    stats.files_seen += 1
-
-    if not is_probably_text_file(filepath):
-        stats.files_skipped_binary += 1
-        logger.debug("Skipping binary file: %s", filepath)
-        return
-
-    try:
-        with filepath.open("r", encoding="utf-8", errors="replace") as f:
-            stats.files_read += 1
-            match_count = 0
-
-            for lineno, raw in enumerate(f, start=1):
-                stats.lines_seen += 1
-                line = raw.rstrip("\n")
-
-                matched = rx.search(line) is not None
-                ok = (not matched) if invert else matched
-
-                if ok:
-                    if count_only:
-                        match_count += 1
-                    else:
-                        shown = line
-                        # Highlight only in normal (non-invert) mode
-                        if color_enabled and not invert:
-                            shown = highlight_regex_first(shown, rx, enabled=True)
 
-                        prefix = f"{filepath}:{lineno}:"
-                        prefix = colorize(prefix, ANSI_DIM, color_enabled)
-                        print(f"{prefix}{shown}")
-                        stats.lines_reported += 1
+def setup_logging(debug: bool) -> tuple[logging.Logger, Path]:
+    log_path = make_log_path()
+    logger = configure_logger(log_path, debug)
 
-            if count_only:
-                prefix = colorize(f"{filepath}:", ANSI_DIM, color_enabled)
-                print(f"{prefix}{match_count}")
-                stats.lines_reported += 1
+    logger.info("Log started: %s", log_path)
+    logger.info("CWD: %s", Path.cwd())
 
-    except OSError as ex:
-        logger.error("Cannot read '%s': %s", filepath, ex)
+    return logger, log_path
 
 
 # ----------------------------
 # CLI
 # ----------------------------
+def positive_int(text: str) -> int:
+    n = int(text)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {n}")
+    return n
+
+
 def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(
         prog="grep.py",
@@ -199,6 +112,18 @@ def build_parser() -> argparse.ArgumentParser:
         default="auto",
         help="Colored output/highlighting (default: auto).",
     )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=None,
+        help="Worker processes (default: one per CPU; 1 disables parallel search).",
+    )
+    p.add_argument(
+        "--cache",
+        metavar="FILE",
+        help="SQLite file caching results per file; unchanged files are not read again.",
+    )
     p.add_argument("--debug", action="store_true", help="Enable debug logging (more verbose log file).")
 
     return p
@@ -227,13 +152,13 @@ def main() -> int:
     t0 = time.perf_counter()
 
     try:
-        flags = re.IGNORECASE if args.ignore_case else 0
         try:
-            rx = re.compile(args.regex, flags)
+            matcher = Matcher(args.regex, args.ignore_case)
         except re.error as ex:
             logger.error("Invalid regex: %s", ex)
             print(colorize(f"Invalid regex: {ex}", ANSI_RED, color_enabled), file=sys.stderr)
             return 2
+        logger.info("Regex backend: %s", matcher.backend)
 
         inputs = [Path(s) for s in args.inputs]
         missing = [p for p in inputs if not p.exists()]
@@ -243,16 +168,45 @@ def main() -> int:
             print(colorize(f"Error: {len(missing)} input path(s) not found.", ANSI_RED, color_enabled), file=sys.stderr)
             return 2
 
-        for fp in iter_files(inputs, recursive=args.recursive):
-            grep_file(
-                filepath=fp,
-                rx=rx,
-                invert=args.invert,
-                count_only=args.count,
-                color_enabled=color_enabled,
-                logger=logger,
+        opts = ScanOptions(
+            invert=args.invert,
+            count_only=args.count,
+            color=color_enabled,
+            recursive=args.recursive,
+            encoding=sys.stdout.encoding or "utf-8",
+            jobs=args.jobs,
+        )
+
+        # Output goes straight to the binary buffer, one write per file
+        interactive = sys.stdout.isatty()
+
+        def write_out(data: bytes) -> None:
+            sys.stdout.buffer.write(data)
+            if interactive:
+                sys.stdout.flush()
+
+        cache = None
+        if args.cache:
+            try:
+                cache = ResultCache(args.cache, matcher, opts)
+            except sqlite3.Error as ex:
+                logger.error("Cannot open cache '%s': %s", args.cache, ex)
+                print(colorize(f"Cannot open cache '{args.cache}': {ex}", ANSI_RED, color_enabled), file=sys.stderr)
+                return 2
+
+        try:
+            scan_path(
+                inputs,
+                matcher,
+                opts,
+                sink=write_out,
                 stats=stats,
+                worker_init=functools.partial(configure_worker_logger, log_path, args.debug),
+                cache=cache,
             )
+        finally:
+            if cache is not None:
+                cache.close()  # keeps what was scanned, even after Ctrl+C
 
         return 0
 
@@ -266,10 +220,13 @@ def main() -> int:
 
         # ALWAYS write performance metrics to the log file
         logger.info(
-            "Performance: files_seen=%d files_read=%d skipped_binary=%d lines_seen=%d lines_reported=%d elapsed=%.6fs",
+            "Performance: files_seen=%d files_read=%d skipped_binary=%d failed=%d cached=%d "
+            "lines_seen=%d lines_reported=%d elapsed=%.6fs",
             stats.files_seen,
             stats.files_read,
             stats.files_skipped_binary,
+            stats.files_failed,
+            stats.files_cached,
             stats.lines_seen,
             stats.lines_reported,
             stats.elapsed_s,
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import sys
 import re
+import os
+
+from scanner import OUT_CHUNK, Matcher, ScanOptions, Stats, scan_stream
 
 
 def eprint(*args, **kwargs):
@@ -22,18 +25,18 @@ def main() -> int:
     path = sys.argv[2]
 
     try:
-        rx = re.compile(pattern)
+        matcher = Matcher(pattern)
     except re.error as ex:
         eprint(f"Invalid regex: {ex}")
         return 2
 
     # Open file or read from stdin
     if path == "-":
-        f = sys.stdin
+        f = sys.stdin.buffer
         close_after = False
     else:
         try:
-            f = open(path, "r", encoding="utf-8", errors="replace")
+            f = open(path, "rb")
             close_after = True
         except FileNotFoundError:
             eprint(f"File not found: {path}")
@@ -42,12 +45,19 @@ def main() -> int:
             eprint(f"Cannot open file '{path}': {ex}")
             return 2
 
+    # Print matching lines with line numbers only ("lineno:line")
+    opts = ScanOptions(with_filename=False, skip_binary=False, encoding=sys.stdout.encoding or "utf-8")
+    size = 0 if path == "-" else os.fstat(f.fileno()).st_size
+
+    def write_out(data: bytes) -> None:
+        sys.stdout.buffer.write(data)
+        sys.stdout.flush()
+
+    # stdin may be a live stream: hand over (and flush) every line as it comes
+    out_chunk = 1 if path == "-" else OUT_CHUNK
+
     try:
-        for lineno, line in enumerate(f, start=1):
-            line_no_nl = line.rstrip("\n")
-            if rx.search(line_no_nl) is not None:
-                # Print matching lines with line numbers
-                print(f"{lineno}:{line_no_nl}")
+        scan_stream(f, path, size, matcher, opts, Stats(), write_out, out_chunk=out_chunk)
     finally:
         if close_after:
             f.close()
@@ -0,0 +1,1073 @@
+from __future__ import annotations
+
+import codecs
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+import re
+import signal
+import sqlite3
+import stat
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from pathlib import Path, PurePath
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+try:
+    import hyperscan  # optional SIMD regex engine (pip install hyperscan)
+except ImportError:
+    hyperscan = None
+
+# Shared by grep.py, phase1.py, phase2.py and phase3.py: one scan loop, every
+# optimization lands once. The CLIs only parse options and format errors.
+
+logger = logging.getLogger("grep")
+
+
+# ----------------------------
+# Color helpers
+# ----------------------------
+ANSI_RESET = "\x1b[0m"
+ANSI_DIM = "\x1b[2m"
+ANSI_RED = "\x1b[31m"
+ANSI_YELLOW = "\x1b[33m"
+ANSI_CYAN = "\x1b[36m"
+
+# Byte forms for the scan loop, encoded once
+HIGHLIGHT_ON = ANSI_YELLOW.encode("ascii")
+HIGHLIGHT_OFF = ANSI_RESET.encode("ascii")
+
+
+def colorize(s: str, color: str, enabled: bool) -> str:
+    return f"{color}{s}{ANSI_RESET}" if enabled else s
+
+
+def highlight_span(line: bytes, span: tuple[int, int]) -> bytes:
+    # span comes from the match that selected the line, so no second regex run
+    a, b = span
+    return line[:a] + HIGHLIGHT_ON + line[a:b] + HIGHLIGHT_OFF + line[b:]
+
+
+# ----------------------------
+# Regex backends
+# ----------------------------
+class HyperscanMatcher:
+    """Block-mode Hyperscan database exposing a re-like search(bytes) -> bool."""
+
+    backend = "hyperscan"
+
+    def __init__(self, pattern: bytes, ignore_case: bool) -> None:
+        flags = hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_ALLOWEMPTY
+        if ignore_case:
+            flags |= hyperscan.HS_FLAG_CASELESS
+        self._db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+        self._db.compile(expressions=[pattern], ids=[0], flags=[flags])
+        self._hit = False
+
+    def _on_match(self, id_, start, end, flags, context) -> None:
+        # SINGLEMATCH: called at most once per scan, so just record the hit
+        self._hit = True
+
+    def search(self, data: bytes) -> bool:
+        self._hit = False
+        self._db.scan(data, match_event_handler=self._on_match)
+        return self._hit
+
+
+class CaseFoldMatcher:
+    """
+    -i for simple ASCII patterns: search a lowercased pattern in line.lower().
+    bytes.lower() is one C pass over the line, cheaper than re.IGNORECASE
+    folding every character inside the engine. Spans are unchanged because
+    lower() keeps the length.
+    """
+
+    backend = "re (ascii case-fold)"
+    __slots__ = ("_search",)
+
+    def __init__(self, pattern: bytes) -> None:
+        self._search = re.compile(pattern.lower()).search
+
+    def search(self, data: bytes):
+        return self._search(data.lower())
+
+
+class TextHit:
+    """Match result of TextMatcher: span() in bytes offsets of the line."""
+
+    __slots__ = ("_span",)
+
+    def __init__(self, span: tuple[int, int]) -> None:
+        self._span = span
+
+    def span(self) -> tuple[int, int]:
+        return self._span
+
+
+class TextMatcher:
+    """
+    Patterns whose meaning depends on Unicode (\w, ., [^x], -i on non-ASCII, ...):
+    match the str pattern on the decoded line, like the original text-mode
+    search. surrogateescape keeps every byte, so spans map back to the line.
+    """
+
+    backend = "re (unicode)"
+    __slots__ = ("_search",)
+
+    def __init__(self, rx: re.Pattern) -> None:
+        self._search = rx.search
+
+    def search(self, data: bytes) -> Optional[TextHit]:
+        text = data.decode("utf-8", "surrogateescape")
+        m = self._search(text)
+        if m is None:
+            return None
+        a, b = m.span()
+        if len(text) != len(data):  # non-ASCII line: char offsets differ from byte offsets
+            a = len(text[:a].encode("utf-8", "surrogateescape"))
+            b = a + len(m.group().encode("utf-8", "surrogateescape"))
+        return TextHit((a, b))
+
+
+class AsciiFirstMatcher:
+    """
+    Case-insensitive "i", "k" and "s" also match "İ", "ı", "K" (Kelvin sign) and
+    "ſ" in text mode. ASCII lines (the common case) are searched as bytes,
+    other lines as text.
+    """
+
+    __slots__ = ("_search", "_text", "backend")
+
+    def __init__(self, engine, text: TextMatcher) -> None:
+        self._search = engine.search
+        self._text = text.search
+        self.backend = getattr(engine, "backend", "re")
+
+    def search(self, data: bytes):
+        return self._search(data) if data.isascii() else self._text(data)
+
+
+Engine = Union[HyperscanMatcher, CaseFoldMatcher, TextMatcher, AsciiFirstMatcher, re.Pattern]
+
+
+def can_case_fold(pattern: str) -> bool:
+    # Escapes (\W, \x41, ...), inline flags and classes ([A-z]) change meaning when lowercased
+    return pattern.isascii() and not any(tok in pattern for tok in ("\\", "[", "(?"))
+
+
+_REGEX_META = frozenset(".^$*+?{}[]\\|()")
+
+# Escapes that mean the same thing on bytes and on str: control characters,
+# anchors, and single-digit back-references (\d, \w, \xe9, \u00e9, ... do not)
+_BYTES_SAFE_ESCAPES = frozenset("tnrfvaAZ123456789")
+
+
+def matches_as_bytes(pattern: str, ignore_case: bool) -> bool:
+    """
+    True if pattern finds the same lines on UTF-8 bytes as on decoded text.
+    Needs an ASCII pattern without Unicode-aware escapes, negated classes or
+    a "." that counts characters. ".*" is fine; so is one greedy ".+" outside
+    any group (two of them, or a repeated one, could split one "é" in two).
+    A plain literal is also safe when case-sensitive: UTF-8 text contains it
+    iff its bytes do.
+    """
+    if not ignore_case and is_plain_literal(pattern):
+        return True
+    if not pattern.isascii():
+        return False
+    i, n = 0, len(pattern)
+    in_class = False
+    depth = 0
+    dot_plus = 0
+    while i < n:
+        c = pattern[i]
+        if c == "\\":
+            nxt = pattern[i + 1:i + 2]
+            if nxt.isalnum() and (nxt not in _BYTES_SAFE_ESCAPES or pattern[i + 2:i + 3].isdigit()):
+                return False
+            i += 2
+            continue
+        if in_class:
+            in_class = c != "]" or pattern[i - 1] in "[^"
+        elif c == "[":
+            if pattern[i + 1:i + 2] == "^":
+                return False
+            in_class = True
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == ".":
+            q = pattern[i + 1:i + 3]
+            if q[:1] == "+":
+                if depth or dot_plus or q == "+?":
+                    return False
+                dot_plus += 1
+            elif q[:1] != "*":
+                return False
+        i += 1
+    return True
+
+
+def is_plain_literal(pattern: str) -> bool:
+    # No metacharacters: the pattern matches exactly its own text
+    return not any(c in _REGEX_META for c in pattern)
+
+
+def folds_beyond_ascii(pattern: str, ignore_case: bool) -> bool:
+    # i/k/s, or a class range that may hold them, under -i or an inline (?i)
+    folding = ignore_case or re.search(r"\(\?[aiLmsux-]*i", pattern) is not None
+    return folding and any(c in pattern for c in "iksIKS[")
+
+
+# Python re syntax that PCRE (Hyperscan's dialect) accepts with another meaning:
+# "a{,3}" is literal text, "[[:digit:]]" a POSIX class, "\v" any vertical space
+_HYPERSCAN_UNSAFE = ("{,", "[:", "\\v")
+
+
+def hyperscan_compatible(pattern: str) -> bool:
+    """
+    Allowlist for Hyperscan: patterns matches_as_bytes accepts (ASCII; escapes
+    only for punctuation, \t \n \r \f \a, \A \Z and back-references), minus
+    _HYPERSCAN_UNSAFE and plain literals. What Hyperscan then rejects (back-
+    references, lookarounds, ...) still falls back to re.
+    """
+    return not is_plain_literal(pattern) and not any(tok in pattern for tok in _HYPERSCAN_UNSAFE)
+
+
+def compile_line_pattern(pattern: str, ignore_case: bool) -> tuple[Optional[re.Pattern], Optional[re.Pattern]]:
+    """
+    (bytes, str) patterns for the line loop. bytes is None when the pattern
+    must be matched on decoded text; str is None when bytes alone give the
+    same lines. Raises re.error for invalid patterns (str re semantics).
+    """
+    flags = re.IGNORECASE if ignore_case else 0
+    rx = re.compile(pattern, flags)
+    if matches_as_bytes(pattern, ignore_case):
+        try:
+            rx_b = re.compile(pattern.encode("utf-8"), flags)
+        except re.error:
+            return None, rx  # valid only as str, e.g. (?u)
+        return rx_b, (rx if folds_beyond_ascii(pattern, ignore_case) else None)
+    return None, rx
+
+
+def compile_pattern(pattern: str, ignore_case: bool, accelerated: bool = True) -> Engine:
+    """
+    Compile pattern for the bytes hot loop using the fastest available backend.
+    Raises re.error for invalid patterns; constructs Hyperscan cannot handle
+    (back-references, lookarounds, ...) silently fall back to Python re.
+    accelerated=False skips Hyperscan and case-folding: re always gives a span.
+    Only hyperscan_compatible patterns go to Hyperscan; plain literals stay on re.
+    """
+    rx_b, rx_text = compile_line_pattern(pattern, ignore_case)
+    if rx_b is None:
+        return TextMatcher(rx_text)
+
+    engine: Engine = rx_b
+    if accelerated and hyperscan is not None and hyperscan_compatible(pattern):
+        try:
+            engine = HyperscanMatcher(rx_b.pattern, ignore_case)
+        except hyperscan.error:
+            pass
+    if accelerated and engine is rx_b and ignore_case and can_case_fold(pattern):
+        engine = CaseFoldMatcher(rx_b.pattern)
+    return engine if rx_text is None else AsciiFirstMatcher(engine, TextMatcher(rx_text))
+
+
+# Assertions that look past the end/start of a line behave differently when
+# the whole file is searched at once, so such patterns stay on the line loop.
+# (\B matches inside an empty line of the buffer, but not in an empty line.)
+_LINE_EDGE_TOKENS = ("$", "\\A", "\\Z", "\\B", "(?=", "(?!", "(?<")
+
+# Anything that can match "\n" lets a failing match run on through the rest of
+# the file, once per candidate: the whole-buffer search would go quadratic.
+_CROSS_LINE_TOKENS = ("[^", "\\D", "\\W", "\\s", "\\n", "\n")
+_DOTALL_RE = re.compile(r"\(\?[aiLmsux-]*s")
+
+
+def compile_scan_pattern(pattern: str, ignore_case: bool) -> re.Pattern | None:
+    """
+    Compile the whole-buffer (mmap) variant of pattern, or return None if the
+    pattern must be matched line by line: line-edge assertions, anything that
+    can match a newline, or Unicode-sensitive constructs.
+    """
+    if any(tok in pattern for tok in _LINE_EDGE_TOKENS):
+        return None
+    if any(tok in pattern for tok in _CROSS_LINE_TOKENS) or _DOTALL_RE.search(pattern):
+        return None
+    if compile_line_pattern(pattern, ignore_case)[1] is not None:
+        return None  # Unicode-sensitive: the line loop matches on decoded text
+    flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+    return re.compile(pattern.encode("utf-8"), flags)
+
+
+_QUANTIFIER_RE = re.compile(r"\{\d*(?:,\d*)?\}")
+
+
+def _skip_class(pattern: str, i: int) -> int:
+    # pattern[i] == "["; return the index just past the matching "]"
+    j = i + 1
+    if pattern[j:j + 1] == "^":
+        j += 1
+    if pattern[j:j + 1] == "]":
+        j += 1  # a leading "]" is a literal
+    while j < len(pattern) and pattern[j] != "]":
+        j += 2 if pattern[j] == "\\" else 1
+    return j + 1
+
+
+def extract_required_literal(pattern: str) -> Optional[bytes]:
+    """
+    Return the longest plain substring that every match of pattern must
+    contain (e.g. b"error" for r"\berror.*fail"), or None if there is none.
+    Only top-level literal runs are considered; groups, classes, escapes like
+    \w and optional characters just end the current run. Case-sensitive.
+    """
+    if "|" in pattern and _has_top_level_alternation(pattern):
+        return None
+    if re.search(r"\(\?[a-zA-Z-]", pattern):
+        return None  # inline flags: (?i), (?x), ... change what a literal means
+    if "(?#" in pattern:
+        return None  # a comment can hand the next quantifier to the run: "ab(?#c)?"
+
+    runs: list[str] = []
+    cur = ""
+    depth = 0
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        atom = None
+        if c == "\\":
+            nxt = pattern[i + 1:i + 2]
+            if depth == 0 and nxt and not nxt.isalnum():
+                atom = nxt  # escaped punctuation: \. \( \\ ...
+            i += 2
+        elif c == "[":
+            i = _skip_class(pattern, i)
+        elif c == "(":
+            depth += 1
+            i += 1
+        elif c == ")":
+            depth -= 1
+            i += 1
+        elif depth == 0 and c not in ".^$*+?{}":
+            atom = c
+            i += 1
+        else:
+            m = _QUANTIFIER_RE.match(pattern, i) if c == "{" else None
+            i = m.end() if m else i + 1
+
+        if atom is None:
+            runs.append(cur)
+            cur = ""
+            continue
+
+        q = pattern[i:i + 1]
+        if q in ("*", "?", "{"):
+            runs.append(cur)  # atom may be absent (or count unknown): drop it
+            cur = ""
+        elif q == "+":
+            runs.append(cur + atom)  # atom required, but what follows may repeat it
+            cur = ""
+        else:
+            cur += atom
+    runs.append(cur)
+
+    best = max(runs, key=len)
+    return best.encode("utf-8") if best else None
+
+
+def _has_top_level_alternation(pattern: str) -> bool:
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "[":
+            i = _skip_class(pattern, i)
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            return True
+        i += 1
+    return False
+
+
+class Matcher:
+    """
+    Everything the scan needs for one pattern, compiled once:
+
+    search   per-line test from the fastest available engine (compile_pattern)
+    rx       plain re engine (accelerated=False), finds the highlight span when search gives none
+    rx_scan  whole-buffer (mmap) pattern, or None if the pattern needs the line loop
+    literal  required substring for the line prefilter, or None
+
+    Raises re.error for an invalid pattern. Pickles as (pattern, ignore_case),
+    so worker processes rebuild it rather than copying compiled state.
+    """
+
+    def __init__(self, pattern: str, ignore_case: bool = False) -> None:
+        self.pattern = pattern
+        self.ignore_case = ignore_case
+
+        self.rx = compile_pattern(pattern, ignore_case, accelerated=False)
+        engine = compile_pattern(pattern, ignore_case)
+        self.search = engine.search
+        self.backend = getattr(engine, "backend", "re")
+        self.rx_scan = compile_scan_pattern(pattern, ignore_case)
+        # Prefilter is a plain (case-sensitive) substring test, so not for -i.
+        # Only engines with a per-line cost above a bytes.find gain from it:
+        # a bytes re already searches for its literal prefix itself.
+        self.literal = None
+        if is_plain_literal(pattern):
+            if self.backend == "re":
+                self.backend = "re (literal)"
+        elif not ignore_case and isinstance(engine, (TextMatcher, AsciiFirstMatcher, HyperscanMatcher)):
+            self.literal = extract_required_literal(pattern)
+
+    def __reduce__(self):
+        return Matcher, (self.pattern, self.ignore_case)
+
+
+# ----------------------------
+# Stats + options
+# ----------------------------
+@dataclass
+class Stats:
+    files_seen: int = 0
+    files_read: int = 0
+    files_skipped_binary: int = 0
+    lines_seen: int = 0
+    lines_reported: int = 0
+    files_failed: int = 0  # could not be opened/read (logged)
+    files_cached: int = 0  # output replayed from the result cache
+    elapsed_s: float = 0.0
+
+    def add(self, other: "Stats") -> None:
+        self.files_seen += other.files_seen
+        self.files_read += other.files_read
+        self.files_skipped_binary += other.files_skipped_binary
+        self.lines_seen += other.lines_seen
+        self.lines_reported += other.lines_reported
+        self.files_failed += other.files_failed
+        self.files_cached += other.files_cached
+
+
+@dataclass
+class ScanOptions:
+    invert: bool = False
+    count_only: bool = False
+    color: bool = False  # dim "file:line:" prefix, highlight the first match
+    with_filename: bool = True  # "file:line:text" (False: "line:text")
+    skip_binary: bool = True
+    recursive: bool = True
+    encoding: str = "utf-8"  # output encoding (normally sys.stdout.encoding)
+    split_large: bool = True  # spread one huge file over a process pool (off inside pool workers)
+    jobs: Optional[int] = None  # worker processes (None: one per CPU; 1: no pool)
+
+    @property
+    def workers(self) -> int:
+        return self.jobs or os.cpu_count() or 1
+
+
+# ----------------------------
+# File iteration + heuristics
+# ----------------------------
+def is_probably_text_file(f: io.BufferedReader, sample_size: int = 4096) -> bool:
+    """
+    NUL-byte probe on a file that is already open for the scan: no second
+    open(), no seek(). os.pread reads just sample_size bytes at offset 0
+    straight from the fd, leaving the reader's buffer and position alone;
+    peek() would copy out everything it buffered (up to READ_BUFFER).
+    """
+    if hasattr(os, "pread"):
+        return b"\x00" not in os.pread(f.fileno(), sample_size, 0)
+    return f.peek(sample_size).find(b"\x00", 0, sample_size) == -1  # Windows
+
+
+# Decided from the extension alone, without opening the file
+TEXT_SUFFIXES = frozenset({
+    ".txt", ".log", ".md", ".rst", ".csv", ".tsv", ".json", ".xml", ".yaml", ".yml",
+    ".toml", ".ini", ".cfg", ".conf", ".html", ".htm", ".css", ".js", ".ts",
+    ".py", ".c", ".h", ".cpp", ".hpp", ".cs", ".java", ".go", ".rs", ".sh", ".bat", ".sql",
+})
+BINARY_SUFFIXES = frozenset({
+    ".jpg", ".jpeg", ".png", ".gif", ".bmp", ".ico", ".webp", ".pdf",
+    ".zip", ".gz", ".bz2", ".xz", ".7z", ".rar", ".tar", ".jar", ".whl",
+    ".exe", ".dll", ".so", ".dylib", ".o", ".obj", ".lib", ".a", ".pyc", ".class",
+    ".mp3", ".mp4", ".avi", ".mkv", ".wav", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx",
+})
+
+
+def text_by_suffix(path: str) -> Optional[bool]:
+    """True/False for known text/binary extensions, None when the content must be probed."""
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix in TEXT_SUFFIXES:
+        return True
+    if suffix in BINARY_SUFFIXES:
+        return False
+    return None
+
+
+def _scan_dir(path: str, recursive: bool, bare_names: bool = False) -> Iterator[tuple[str, os.stat_result]]:
+    # os.scandir gives file/dir type from the directory listing itself (no stat per entry)
+    # bare_names: name entries "a.txt", not "./a.txt" (for the current folder)
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return  # unreadable folder: skip it, like Path.rglob does
+
+    # A folder's own files first, then its subfolders: the os.walk/rglob order
+    subdirs = []
+    for entry in entries:
+        name = entry.name if bare_names else entry.path
+        try:
+            if entry.is_file():
+                yield name, entry.stat()
+            elif recursive and entry.is_dir(follow_symlinks=False):
+                subdirs.append(name)
+        except OSError:
+            continue
+    for sub in subdirs:
+        yield from _scan_dir(sub, recursive)
+
+
+def iter_files(inputs: Iterable[Union[str, Path]], recursive: bool) -> Iterator[tuple[str, os.stat_result]]:
+    """
+    Yield (path, stat) for every file to search. Paths are plain str from here
+    on: no Path object per file, and cheaper to send to pool workers.
+    """
+    for p in inputs:
+        path = os.fspath(p)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            yield path, st
+        elif stat.S_ISDIR(st.st_mode):
+            # Path(".") / "a.txt" is "a.txt"; a str "." keeps os.path.join's "./a.txt"
+            yield from _scan_dir(path, recursive, bare_names=isinstance(p, PurePath) and path == os.curdir)
+
+
+# ----------------------------
+# Scan core
+# ----------------------------
+OUT_CHUNK = 1 << 16  # output is handed to the sink in pieces of about this size
+MMAP_THRESHOLD = 1 << 20  # files this big (or bigger) are searched as one mmap'ed buffer
+NEWLINE = os.linesep.encode("ascii")  # what print() would have written for "\n"
+READ_BUFFER = 1 << 20  # streaming read size (default BufferedReader is 8 KiB)
+SPLIT_THRESHOLD = 32 << 20  # files this big are split by line ranges over a process pool
+SPLIT_CHUNK = 16 << 20  # target size of one range
+
+
+def advise_sequential(f) -> None:
+    # Ask the kernel for aggressive readahead; not available on Windows/macOS
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def count_newlines(buf, start: int, end: int, chunk: int = 1 << 20) -> int:
+    # mmap has no count(); slice in chunks so a big gap never copies the whole file
+    n = 0
+    for a in range(start, end, chunk):
+        n += buf[a:min(a + chunk, end)].count(b"\n")
+    return n
+
+
+Span = Optional[tuple[int, int]]
+
+
+def match_span(hit) -> Span:
+    # re gives a Match with a position; Hyperscan only says "matched"
+    return None if hit is True else hit.span()
+
+
+def iter_lines_matched(f, matcher: Matcher, invert: bool, stats: Stats) -> Iterator[tuple[int, bytes, Span]]:
+    """
+    Line loop: yield (lineno, line, span of first match or None) for every line to report.
+    Lines without the required literal are rejected by a substring test, without the regex.
+    """
+    search, literal = matcher.search, matcher.literal  # bound once, not looked up per line
+    lineno = 0
+    for lineno, raw in enumerate(f, start=1):
+        line = raw.rstrip(b"\r\n")
+
+        hit = search(line) if literal is None or line.find(literal) != -1 else None
+        if invert:
+            if not hit:
+                yield lineno, line, None
+        elif hit:
+            yield lineno, line, match_span(hit)
+    stats.lines_seen += lineno
+
+
+def iter_lines_matched_mmap(
+    mm: mmap.mmap,
+    matcher: Matcher,
+    stats: Stats,
+    start: int = 0,
+    end: Optional[int] = None,
+) -> Iterator[tuple[int, bytes, Span]]:
+    """
+    Whole-buffer search: matcher.rx_scan jumps straight to candidate lines. A match
+    that stays inside its line is a line match; one that runs past the end of
+    the line is re-checked with the per-line matcher, so the results are the
+    same as the line loop. Lines without a candidate are never touched.
+    start/end limit the search to a range of whole lines; line numbers count
+    from the first line of the range.
+    Line numbers come from counting the newlines between candidates (C-level
+    bytes.count); the rest of the range is counted at the end, so the buffer
+    is counted in one pass, which also gives lines_seen.
+    """
+    size = len(mm) if end is None else end
+
+    # Bound once: attribute lookups are a real share of the per-candidate cost
+    search, verify = matcher.rx_scan.search, matcher.search
+    find, rfind = mm.find, mm.rfind
+
+    # endpos only cuts off matches that cross the range end, and those would be
+    # re-checked per line anyway, so a range gives the same lines as the whole file
+    lineno, counted_to, pos = 1, start, start
+    while pos <= size:
+        m = search(mm, pos, size)
+        if m is None:
+            break
+        ms, me = m.span()
+
+        # pos is always a line start, so the search for the line start can stop there
+        line_start = rfind(b"\n", pos, ms) + 1 or pos
+        if line_start == size:
+            break  # empty match after the final newline: not a real line
+        line_end = find(b"\n", ms, size)
+        if line_end == -1:
+            line_end = size
+
+        if line_start - counted_to < 1 << 20:
+            lineno += mm[counted_to:line_start].count(b"\n")
+        else:
+            lineno += count_newlines(mm, counted_to, line_start)
+        counted_to = line_start
+
+        line = mm[line_start:line_end].rstrip(b"\r")
+        if me <= line_start + len(line):
+            yield lineno, line, (ms - line_start, me - line_start)
+        else:
+            hit = verify(line)
+            if hit:
+                yield lineno, line, match_span(hit)
+        pos = line_end + 1
+
+    lines = lineno - 1 + count_newlines(mm, counted_to, size)
+    stats.lines_seen += lines + (1 if mm[size - 1:size] != b"\n" else 0)
+
+
+def split_lines(mm: mmap.mmap, parts: int) -> list[tuple[int, int]]:
+    """Cut mm into about `parts` (start, end) ranges, each ending just after a newline."""
+    size = len(mm)
+    bounds = [0]
+    for i in range(1, parts):
+        cut = mm.find(b"\n", max(bounds[-1], size * i // parts))
+        if cut == -1:
+            break
+        bounds.append(cut + 1)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def iter_lines_matched_split(
+    path: str,
+    mm: mmap.mmap,
+    matcher: Matcher,
+    stats: Stats,
+    workers: int,
+) -> Iterator[tuple[int, bytes, Span]]:
+    """
+    One big file on several cores: each worker maps the file itself and runs
+    iter_lines_matched_mmap over its own range of lines. Results come back in
+    file order; a range's line numbers are shifted by the lines before it.
+    At most two ranges per worker are in flight, so a match-heavy file is not
+    held in memory all at once.
+    """
+    ranges = split_lines(mm, max(workers, len(mm) // SPLIT_CHUNK))
+    ex = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(matcher, None, None))
+    try:
+        pending: deque = deque()
+        todo = iter(ranges)
+        lines_before = 0
+        while True:
+            while len(pending) < 2 * workers:
+                r = next(todo, None)
+                if r is None:
+                    break
+                pending.append(ex.submit(_scan_range, path, *r))
+            if not pending:
+                break
+            found, lines = pending.popleft().result()
+            for lineno, line, span in found:
+                yield lines_before + lineno, line, span
+            lines_before += lines
+        stats.lines_seen += lines_before
+    finally:
+        ex.shutdown(wait=True, cancel_futures=True)
+
+
+def scan_stream(
+    f,
+    name: str,
+    size: int,
+    matcher: Matcher,
+    opts: ScanOptions,
+    stats: Stats,
+    sink: Callable[[bytes], object],
+    path: Optional[str] = None,
+    out_chunk: int = OUT_CHUNK,
+) -> None:
+    """
+    Search an open binary stream (a file, or stdin with size=0) and hand the
+    encoded output to sink, in pieces of about out_chunk bytes (1: every line).
+    path lets a huge file be reopened and split over worker processes.
+    """
+    out = bytearray()
+    encoding, color = opts.encoding, opts.color
+    # UTF-8 output: non-highlighted lines are copied as raw bytes, no decode/encode
+    raw_lines = codecs.lookup(encoding).name == "utf-8"
+    name_prefix = f"{name}:" if opts.with_filename else ""
+    # "file:" is the same for every line: encode it (and its color codes) once,
+    # so each reported line only adds its line number
+    if color:
+        head = f"{ANSI_DIM}{name_prefix}".encode(encoding, "replace")
+        tail = f":{ANSI_RESET}".encode(encoding, "replace")
+    else:
+        head = name_prefix.encode(encoding, "replace")
+        tail = b":"
+    match_count = 0
+
+    # Big files: one mmap'ed buffer instead of a Python object per line.
+    # Invert mode needs every line anyway, so it stays on the line loop.
+    mm = None
+    if matcher.rx_scan is not None and not opts.invert and size >= MMAP_THRESHOLD:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        if mm is not None and path is not None and opts.split_large and size >= SPLIT_THRESHOLD and opts.workers > 1:
+            reported = iter_lines_matched_split(path, mm, matcher, stats, opts.workers)
+        elif mm is not None:
+            reported = iter_lines_matched_mmap(mm, matcher, stats)
+        else:
+            reported = iter_lines_matched(f, matcher, opts.invert, stats)
+
+        for lineno, line, span in reported:
+            if opts.count_only:
+                match_count += 1
+                continue
+
+            out += head
+            out += b"%d" % lineno
+            out += tail
+
+            # Highlight only in normal (non-invert) mode
+            if color and not opts.invert:
+                if span is None:
+                    m = matcher.rx.search(line)
+                    span = m.span() if m else None
+                if span is not None:
+                    line = highlight_span(line, span)
+
+            if raw_lines:
+                out += line
+            else:
+                out += line.decode("utf-8", "replace").encode(encoding, "replace")
+            out += NEWLINE
+            stats.lines_reported += 1
+
+            if len(out) >= out_chunk:
+                sink(out)
+                out = bytearray()
+    finally:
+        if mm is not None:
+            mm.close()
+
+    if opts.count_only:
+        prefix = colorize(name_prefix, ANSI_DIM, color)
+        out += f"{prefix}{match_count}".encode(encoding, "replace") + NEWLINE
+        stats.lines_reported += 1
+
+    if out:
+        sink(out)
+
+
+def scan_file(
+    filepath: str,
+    st: os.stat_result,
+    matcher: Matcher,
+    opts: ScanOptions,
+    sink: Callable[[bytes], object],
+) -> Stats:
+    """Search one file from iter_files; returns the stats for this file."""
+    stats = Stats(files_seen=1)
+
+    if st.st_size == 0:
+        # Nothing to search; no need to probe or open it (count mode still prints "file:0")
+        stats.files_read += 1
+        scan_stream(io.BytesIO(), filepath, 0, matcher, opts, stats, sink)
+        return stats
+
+    is_text = text_by_suffix(filepath) if opts.skip_binary else True
+    if is_text is False:
+        stats.files_skipped_binary += 1
+        logger.debug("Skipping binary file: %s", filepath)
+        return stats
+
+    try:
+        # Binary mode: match on raw bytes, decode only the lines we print
+        # Buffer sized to the file, so tiny files don't allocate a full 1 MiB each
+        buffering = max(io.DEFAULT_BUFFER_SIZE, min(st.st_size, READ_BUFFER))
+        with open(filepath, "rb", buffering=buffering) as f:
+            # Unknown extension: probe the start of the file we just opened for the scan
+            if is_text is None and not is_probably_text_file(f):
+                stats.files_skipped_binary += 1
+                logger.debug("Skipping binary file: %s", filepath)
+                return stats
+
+            advise_sequential(f)
+            stats.files_read += 1
+            scan_stream(f, filepath, st.st_size, matcher, opts, stats, sink, path=filepath)
+
+    except OSError as ex:
+        stats.files_failed += 1
+        logger.error("Cannot read '%s': %s", filepath, ex)
+
+    return stats
+
+
+# ----------------------------
+# Result cache
+# ----------------------------
+class ResultCache:
+    """
+    On-disk (SQLite) cache of each file's output and stats, so a rerun over an
+    unchanged tree replays results instead of reading files. A row is valid
+    while the file keeps its mtime and size. Rows are kept per search: the key
+    hashes everything that changes the output (pattern, flags, encoding, and the
+    working directory, since names are printed as given).
+    """
+
+    def __init__(self, db_path: str, matcher: Matcher, opts: ScanOptions) -> None:
+        """Raises sqlite3.Error if the file is not a usable cache (e.g. another schema)."""
+        search = [
+            matcher.pattern, matcher.ignore_case, opts.invert, opts.count_only, opts.color,
+            opts.with_filename, opts.skip_binary, opts.encoding, os.getcwd(),
+        ]
+        self.key = hashlib.sha256(json.dumps(search).encode("utf-8")).hexdigest()
+        self.db: Optional[sqlite3.Connection] = sqlite3.connect(db_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " pattern_hash TEXT, path TEXT, mtime_ns INTEGER, size INTEGER, output BLOB,"
+            " files_read INTEGER, skipped_binary INTEGER, lines_seen INTEGER, lines_reported INTEGER,"
+            " PRIMARY KEY (pattern_hash, path))"
+        )
+        # An existing table with other columns fails here, not in the middle of the scan
+        self.db.execute(
+            "SELECT pattern_hash, path, mtime_ns, size, output, files_read, skipped_binary, lines_seen, lines_reported"
+            " FROM results LIMIT 0"
+        )
+
+    def _disable(self, ex: sqlite3.Error) -> None:
+        # Any later failure: log it and go on without the cache
+        logger.error("Cache error, continuing without cache: %s", ex)
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def lookup(self, files: list[tuple[str, os.stat_result]]) -> list[Optional[Stats]]:
+        """
+        Cached stats for each file, or None where it must be scanned.
+        Only the small columns are read here; output() fetches a hit's bytes.
+        """
+        if self.db is None:
+            return [None] * len(files)
+        wanted = {path: st for path, st in files}
+        rows = {}
+        try:
+            for path, *row in self.db.execute(
+                "SELECT path, mtime_ns, size, files_read, skipped_binary, lines_seen, lines_reported"
+                " FROM results WHERE pattern_hash = ?",
+                (self.key,),
+            ):
+                if path in wanted:
+                    rows[path] = row
+        except sqlite3.Error as ex:
+            self._disable(ex)
+            return [None] * len(files)
+
+        hits: list[Optional[Stats]] = []
+        for path, st in files:
+            row = rows.get(path)
+            if row is None or row[0] != st.st_mtime_ns or row[1] != st.st_size:
+                hits.append(None)
+                continue
+            files_read, skipped_binary, lines_seen, lines_reported = row[2:]
+            hits.append(Stats(
+                files_seen=1,
+                files_read=files_read,
+                files_skipped_binary=skipped_binary,
+                lines_seen=lines_seen,
+                lines_reported=lines_reported,
+                files_cached=1,
+            ))
+        return hits
+
+    def output(self, path: str) -> Optional[bytes]:
+        """Stored output of a lookup() hit, or None if it can no longer be read."""
+        if self.db is None:
+            return None
+        try:
+            row = self.db.execute(
+                "SELECT output FROM results WHERE pattern_hash = ? AND path = ?", (self.key, path)
+            ).fetchone()
+        except sqlite3.Error as ex:
+            self._disable(ex)
+            return None
+        return None if row is None else row[0]
+
+    def store(self, path: str, st: os.stat_result, output: bytes, file_stats: Stats) -> None:
+        if self.db is None or file_stats.files_failed:
+            return  # a read error is not a result; try again next run
+        try:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.key, path, st.st_mtime_ns, st.st_size, bytes(output), file_stats.files_read,
+                    file_stats.files_skipped_binary, file_stats.lines_seen, file_stats.lines_reported,
+                ),
+            )
+        except sqlite3.Error as ex:
+            self._disable(ex)
+
+    def close(self) -> None:
+        if self.db is None:
+            return
+        try:
+            self.db.commit()
+        except sqlite3.Error as ex:
+            logger.error("Cannot save cache: %s", ex)
+        finally:
+            self.db.close()
+            self.db = None
+
+
+# ----------------------------
+# Parallel workers
+# ----------------------------
+# Per-process state, set once by _init_worker
+_worker: dict = {}
+
+
+def _init_worker(matcher: Matcher, opts: Optional[ScanOptions], worker_init: Optional[Callable[[], object]]) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C is handled by the parent
+    _worker.update(matcher=matcher, opts=opts)
+    if worker_init is not None:
+        worker_init()
+
+
+def _scan_captured(item: tuple[str, os.stat_result], matcher: Matcher, opts: ScanOptions) -> tuple[bytearray, Stats]:
+    filepath, st = item
+    out = bytearray()
+    file_stats = scan_file(filepath, st, matcher, opts, out.extend)
+    return out, file_stats
+
+
+def _scan_one(item: tuple[str, os.stat_result]) -> tuple[bytearray, Stats]:
+    return _scan_captured(item, _worker["matcher"], _worker["opts"])
+
+
+def _scan_range(path: str, start: int, end: int) -> tuple[list[tuple[int, bytes, Span]], int]:
+    range_stats = Stats()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        found = list(iter_lines_matched_mmap(mm, _worker["matcher"], range_stats, start, end))
+    return found, range_stats.lines_seen
+
+
+def scan_path(
+    inputs: Iterable[Union[str, Path]],
+    matcher: Matcher,
+    opts: ScanOptions,
+    sink: Callable[[bytes], object],
+    stats: Optional[Stats] = None,
+    worker_init: Optional[Callable[[], object]] = None,
+    cache: Optional[ResultCache] = None,
+) -> Stats:
+    """
+    Search every file under inputs, writing output to sink in input order.
+    Several files are spread over a pool of opts.workers processes, one file
+    per task; on slow (network) storage, more jobs than CPUs keeps the CPUs
+    busy while other workers wait on open() and read();
+    worker_init (picklable) runs once in each worker, e.g. to set up logging.
+    With a cache, unchanged files replay their stored output and only the
+    rest are scanned (and stored).
+    Counters are added to stats as files finish, so they are correct even
+    if the scan is interrupted.
+    """
+    if stats is None:
+        stats = Stats()
+    files = list(iter_files(inputs, recursive=opts.recursive))
+    hits = cache.lookup(files) if cache is not None else [None] * len(files)
+    todo = [item for item, hit in zip(files, hits) if hit is None]
+
+    if cache is None and not (len(todo) > 1 and opts.workers > 1):
+        # Serial and uncached: output goes to sink as it is found
+        for fp, st in todo:
+            stats.add(scan_file(fp, st, matcher, opts, sink))
+        return stats
+
+    ex = None
+    if len(todo) > 1 and opts.workers > 1:
+        # Write buffered log records (run header) before workers append their own
+        for h in logger.handlers:
+            h.flush()
+        ex = ProcessPoolExecutor(
+            max_workers=opts.workers,
+            initializer=_init_worker,
+            initargs=(matcher, replace(opts, split_large=False), worker_init),
+        )
+        # map() keeps results in input order
+        scanned = ex.map(_scan_one, todo, chunksize=32)
+    else:
+        scanned = (_scan_captured(item, matcher, opts) for item in todo)
+
+    try:
+        for (fp, st), hit in zip(files, hits):
+            if hit is None:
+                out, file_stats = next(scanned)
+                if cache is not None:
+                    cache.store(fp, st, out, file_stats)
+            else:
+                out, file_stats = cache.output(fp), hit
+                if out is None:
+                    out, file_stats = _scan_captured((fp, st), matcher, opts)  # cached row is gone
+            if out:
+                sink(out)
+            stats.add(file_stats)
+    finally:
+        if ex is not None:
+            ex.shutdown(wait=True, cancel_futures=True)
+
+    return stats
@@ -0,0 +1,219 @@
+"""Regression tests for scanner.py (run with: python -m unittest)."""
+
+import os
+import re
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import scanner
+
+LINES = [
+    "error at 1 # disk",
+    "",
+    "info ok",
+    "",
+    "Fail now\r",
+    "ab x\ty",
+    "été ÉTÉ naïve",
+    "error 2 happened",
+    "   ",
+    "end",
+]
+
+PATTERNS = [
+    "error", "fail|ok", "^ok", "ok ", r"\s", r"[^a]", "", r"\bab\b", r"\B", "e.*d",
+    r"ab\s+x", "^$", "x$", "Fail", "(?s)ok.ab", r"\t", "été", "error[^#]*happened", r"\D+", r"\W",
+]
+
+
+class MmapMatchesLineLoop(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(fd, "wb") as f:
+            f.write("\n".join(LINES).encode("utf-8"))
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+
+    def scan(self, pattern: str, ignore_case: bool, mmap_threshold: int) -> tuple[bytes, int]:
+        out = bytearray()
+        opts = scanner.ScanOptions(color=True, jobs=1)
+        with mock.patch.object(scanner, "MMAP_THRESHOLD", mmap_threshold):
+            stats = scanner.scan_file(self.path, os.stat(self.path), scanner.Matcher(pattern, ignore_case), opts, out.extend)
+        return bytes(out), stats.lines_seen
+
+    def test_same_output(self) -> None:
+        for pattern in PATTERNS:
+            for ignore_case in (False, True):
+                with self.subTest(pattern=pattern, ignore_case=ignore_case):
+                    self.assertEqual(self.scan(pattern, ignore_case, 1), self.scan(pattern, ignore_case, 1 << 60))
+
+    def test_patterns_that_can_cross_lines_use_line_loop(self) -> None:
+        for pattern in ("error[^#]*QQQ", r"err\D*QQQ", r"a\W+b", r"a\s+b", "(?s)a.*b", r"a\nb", r"\Bx"):
+            with self.subTest(pattern=pattern):
+                self.assertIsNone(scanner.compile_scan_pattern(pattern, False))
+
+
+# pattern, ignore_case, whether matching UTF-8 bytes gives the same lines as matching text
+BYTES_SAFETY = [
+    ("error|fail", False, True),
+    ("a.*b.*c", False, True),
+    ("a.+b", False, True),
+    ("été", False, True),
+    ("été", True, False),
+    ("[é]", False, False),
+    (r"^\w+$", False, False),
+    ("^.{3}$", False, False),
+    ("a.b", False, False),
+    ("[^x]", False, False),
+    (".+.+", False, False),
+    ("(.+){2}", False, False),
+    ("a*?.+?.+?", True, False),
+    ("x.+?", False, False),
+]
+
+
+class BytesSafety(unittest.TestCase):
+    def test_table(self) -> None:
+        for pattern, ignore_case, safe in BYTES_SAFETY:
+            with self.subTest(pattern=pattern, ignore_case=ignore_case):
+                self.assertEqual(scanner.matches_as_bytes(pattern, ignore_case), safe)
+
+    def test_matcher_agrees_with_text_re(self) -> None:
+        lines = ["é", "ÉTÉ", "été", "aéb", "x"]
+        for pattern, ignore_case, _ in BYTES_SAFETY:
+            rx = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+            matcher = scanner.Matcher(pattern, ignore_case)
+            for line in lines:
+                with self.subTest(pattern=pattern, ignore_case=ignore_case, line=line):
+                    self.assertEqual(bool(matcher.search(line.encode("utf-8"))), bool(rx.search(line)))
+
+    def test_hyperscan_allowlist(self) -> None:
+        # PCRE reads these differently from re: they must stay on re
+        for pattern in ("a{,3}b", "[[:digit:]]", r"x\vy", "error"):
+            with self.subTest(pattern=pattern):
+                self.assertFalse(scanner.hyperscan_compatible(pattern))
+        self.assertTrue(scanner.hyperscan_compatible("err(or|x)"))
+
+
+# pattern, the substring every match must contain (None: no prefilter)
+REQUIRED_LITERAL = [
+    (r"\berror.*fail", b"error"),
+    ("err(or|x)", b"err"),
+    ("ab+c", b"ab"),
+    ("ab?c", b"a"),
+    ("abc*d", b"ab"),
+    ("x{2}y", b"y"),
+    ("[a-z]+tail", b"tail"),
+    (r"foo\.bar", b"foo.bar"),
+    ("a|b", None),
+    ("(?i)abc", None),
+    ("", None),
+]
+
+
+class RequiredLiteral(unittest.TestCase):
+    def test_table(self) -> None:
+        for pattern, literal in REQUIRED_LITERAL:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(scanner.extract_required_literal(pattern), literal)
+
+    def test_comment_group(self) -> None:
+        self.assertIsNone(scanner.extract_required_literal("ab(?#c)?"))
+        self.assertIsNotNone(scanner.Matcher("ab(?#c)?").search(b"a"))
+
+
+class SplitMatchesSerial(unittest.TestCase):
+    def test_same_output(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "big.txt")
+            with open(path, "wb") as f:
+                for i in range(20000):
+                    f.write(b"line %d %s\n" % (i, b"error here" if i % 7 == 0 else b"ok"))
+            matcher = scanner.Matcher("err(or|x)")
+            results = []
+            split = mock.patch.object(scanner, "split_lines", wraps=scanner.split_lines)
+            with mock.patch.multiple(scanner, MMAP_THRESHOLD=1, SPLIT_THRESHOLD=1, SPLIT_CHUNK=1 << 14), split as split_lines:
+                for jobs in (1, 2):
+                    out = bytearray()
+                    opts = scanner.ScanOptions(color=True, jobs=jobs)
+                    stats = scanner.scan_file(path, os.stat(path), matcher, opts, out.extend)
+                    results.append((bytes(out), stats.lines_seen, stats.lines_reported))
+            self.assertEqual(split_lines.call_count, 1)  # only jobs=2 splits
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(results[0][1:], (20000, 2858))
+
+
+class ResultCacheRuns(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "a.txt")
+        self.db = os.path.join(self.tmp.name, "cache.db")
+        with open(self.path, "w") as f:
+            f.write("error one\nok\nerror two\n")
+        self.matcher = scanner.Matcher("error")
+        self.opts = scanner.ScanOptions(jobs=1)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def run_cached(self) -> tuple[bytes, scanner.Stats]:
+        out = bytearray()
+        cache = scanner.ResultCache(self.db, self.matcher, self.opts)
+        try:
+            stats = scanner.scan_path([self.path], self.matcher, self.opts, out.extend, cache=cache)
+        finally:
+            cache.close()
+        return bytes(out), stats
+
+    def test_hit_then_stale_mtime(self) -> None:
+        first, stats = self.run_cached()
+        self.assertEqual((stats.files_cached, stats.lines_reported), (0, 2))
+
+        out, stats = self.run_cached()
+        self.assertEqual(out, first)
+        self.assertEqual((stats.files_cached, stats.lines_reported), (1, 2))
+
+        # Same size, new mtime: the row is stale and the new text is scanned
+        st = os.stat(self.path)
+        with open(self.path, "w") as f:
+            f.write("error ONE\nok\nerror TWO\n")
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        out, stats = self.run_cached()
+        self.assertEqual(out, first.replace(b"one", b"ONE").replace(b"two", b"TWO"))
+        self.assertEqual(stats.files_cached, 0)
+
+    def test_foreign_schema(self) -> None:
+        db = sqlite3.connect(self.db)
+        db.execute("CREATE TABLE results (a, b)")
+        db.commit()
+        db.close()
+        with self.assertRaises(sqlite3.Error):
+            scanner.ResultCache(self.db, self.matcher, self.opts)
+
+
+class IterFilesNames(unittest.TestCase):
+    def test_current_folder_names(self) -> None:
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "sub"))
+            for name in ("a.txt", os.path.join("sub", "b.txt")):
+                with open(os.path.join(tmp, name), "w") as f:
+                    f.write("error\n")
+            os.chdir(tmp)
+            try:
+                # grep.py passes Path("."): names as Path(".") / name gives them
+                found = [p for p, _ in scanner.iter_files([Path(".")], recursive=True)]
+                self.assertEqual(found, ["a.txt", os.path.join("sub", "b.txt")])
+                # phase2/phase3 pass the raw "." and print os.path.join names
+                found = [p for p, _ in scanner.iter_files(["."], recursive=True)]
+                self.assertEqual(found, [os.path.join(".", "a.txt"), os.path.join(".", "sub", "b.txt")])
+            finally:
+                os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    unittest.main()